@@ -1,14 +1,28 @@
 from argparse import ArgumentParser, Namespace
 from enum import Enum
 from os import path
-from typing import Optional, Sequence, Text, Type
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO, Optional, Sequence, Text, Type
 
 from pendulum import from_timestamp
 
-from .encode import ZipEncoder, ZipFile
+from .encode import FileDataSegment, Segment, ZipEncoder, ZipFile
 from .storage import CompactFile, DeflateStore, Store
 from .stream import FileStream
 
+# Buffer size of the output file. Headers are tiny so they are better grouped
+# with the surrounding data before being written.
+WRITE_BUFFER_SIZE = 1024 ** 2  # 1 Mio
+
+# Number of chunks which can be read in advance while previous ones are still
+# being written
+PIPELINE_SIZE = 8
+
+
+# Storage class for each value of the CLI "-store" argument
+STORES = {"store": Store, "deflate": DeflateStore}
+
 
 class StoreType(Enum):
     """
@@ -23,10 +37,7 @@ class StoreType(Enum):
         Returns the class corresponding to this store name
         """
 
-        if self.value == "store":
-            return Store
-        elif self.value == "deflate":
-            return DeflateStore
+        return STORES[self.value]
 
 
 def parse_args(argv: Optional[Sequence[Text]] = None) -> Namespace:
@@ -72,6 +83,82 @@ def parse_args(argv: Optional[Sequence[Text]] = None) -> Namespace:
     return parser.parse_args(argv)
 
 
+def _get_sendable_store(segment: Segment) -> Optional[Store]:
+    """
+    Returns the store of a file data segment if it can be sent directly by the
+    kernel (see `Store.send_data()`).
+    """
+
+    if isinstance(segment, FileDataSegment):
+        store = segment.file.data
+
+        if isinstance(store, Store) and store.can_send_data:
+            return store
+
+
+def _produce(encoder: ZipEncoder, queue: Queue) -> None:
+    """
+    Puts all the chunks of the archive into the queue, followed by None, or by
+    the exception if one happens. This runs in a background thread.
+
+    Stores which can be sent directly are put in the queue instead of their
+    data. They must be fully sent before going on since the next segments need
+    their CRC, so the thread waits for the queue to be processed.
+    """
+
+    try:
+        for segment in encoder.segments:
+            store = _get_sendable_store(segment)
+
+            if store:
+                queue.put(store)
+                queue.join()
+            else:
+                for data in segment.get_data():
+                    queue.put(data)
+    except Exception as e:
+        queue.put(e)
+    else:
+        queue.put(None)
+
+
+def write_archive(encoder: ZipEncoder, f: BinaryIO) -> None:
+    """
+    Writes the archive into the file. Files which are stored as-is are sent
+    directly by the kernel (see `Store.send_data()`) while everything else
+    goes through `get_data()`.
+
+    The data is generated in a background thread, so that the next chunks are
+    read while the previous ones are being written.
+
+    Parameters
+    ----------
+    encoder
+        Prepared encoder
+    f
+        File opened in binary write mode
+    """
+
+    queue = Queue(maxsize=PIPELINE_SIZE)
+    Thread(target=_produce, args=(encoder, queue), daemon=True).start()
+
+    while True:
+        item = queue.get()
+
+        try:
+            if item is None:
+                return
+            elif isinstance(item, Exception):
+                raise item
+            elif isinstance(item, Store):
+                f.flush()
+                item.send_data(f.fileno())
+            else:
+                f.write(item)
+        finally:
+            queue.task_done()
+
+
 def main(argv: Optional[Sequence[Text]] = None) -> None:
     """
     Adds all the files from CLI arguments into an archive. This is just for
@@ -112,9 +199,8 @@ def main(argv: Optional[Sequence[Text]] = None) -> None:
     encoder.prepare()
     print(f"Index prepared, output will be {encoder.file_size} octets")
 
-    with open(args.archive, "wb") as f:
-        for data in encoder.get_data():
-            f.write(data)
+    with open(args.archive, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        write_archive(encoder, f)
 
     print(f"All done!")
 
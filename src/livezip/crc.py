@@ -0,0 +1,198 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from os import cpu_count
+from typing import Deque, Optional, Tuple
+
+# The implementation is picked once here. ISA-L and zlib-ng both ship a CRC32
+# which uses the PCLMULQDQ/ARMv8 instructions when the CPU supports them, with
+# the exact same signature as zlib's.
+try:
+    from isal.isal_zlib import crc32
+
+    HARDWARE_CRC32 = True
+except ImportError:
+    try:
+        from zlib_ng.zlib_ng import crc32
+
+        HARDWARE_CRC32 = True
+    except ImportError:
+        from zlib import crc32
+
+        HARDWARE_CRC32 = False
+
+# Reversed CRC-32 polynomial, as used by ZIP
+POLY = 0xEDB88320
+
+
+def _multmodp(a: int, b: int) -> int:
+    """
+    Multiplies two polynomials modulo the CRC polynomial. Both are in the
+    reflected bit order used by the CRC.
+    """
+
+    m = 1 << 31
+    p = 0
+
+    while True:
+        if a & m:
+            p ^= b
+
+            if not a & (m - 1):
+                break
+
+        m >>= 1
+        b = (b >> 1) ^ POLY if b & 1 else b >> 1
+
+    return p
+
+
+def _make_x2n_table():
+    """
+    Table of x^(2^n) modulo the CRC polynomial, for n from 0 to 31
+    """
+
+    p = 1 << 30  # x^1
+    table = [p]
+
+    for _ in range(1, 32):
+        p = _multmodp(p, p)
+        table.append(p)
+
+    return table
+
+
+_X2N_TABLE = _make_x2n_table()
+
+
+@lru_cache(maxsize=64)
+def _x2nmodp(n: int, k: int) -> int:
+    """
+    Computes x^(n * 2^k) modulo the CRC polynomial. Chunks tend to all have
+    the same length so the result is cached.
+    """
+
+    p = 1 << 31  # x^0 == 1
+
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N_TABLE[k & 31], p)
+
+        n >>= 1
+        k += 1
+
+    return p
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    Combines the CRC32 of two consecutive pieces of data, without needing the
+    data itself. This is a port of zlib's `crc32_combine()`, which Python's
+    zlib module doesn't expose.
+
+    Parameters
+    ----------
+    crc1
+        CRC32 of the first piece of data
+    crc2
+        CRC32 of the second piece of data
+    len2
+        Length of the second piece of data, in bytes
+
+    Returns
+    -------
+    The CRC32 of both pieces of data concatenated
+    """
+
+    return _multmodp(_x2nmodp(len2, 3), crc1) ^ crc2
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by all CRC computations, created on first use.
+    """
+
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=(cpu_count() or 1), thread_name_prefix="livezip-crc"
+        )
+
+    return _executor
+
+
+class ParallelCrc32:
+    """
+    Computes the CRC32 of a stream of chunks in background threads. Each
+    chunk's CRC is computed independently (the CRC functions release the GIL)
+    and they are then combined in order using `crc32_combine()`.
+
+    This allows the CRC to be computed while the data is being sent instead
+    of before, and on several cores at once. Big chunks are also cut into
+    lanes of LANE_SIZE bytes (without copying) which are checksummed
+    independently, so that a single chunk is spread over several cores. At
+    most MAX_PENDING lanes are waiting to be processed at any time, so that
+    memory stays bound.
+
+    Chunks smaller than MIN_PARALLEL_SIZE are not worth the cost of a thread
+    hand-off and of the combination, so they are computed right away. For the
+    same reason, threads are not used at all when a hardware CRC is available
+    since it goes at tens of GB/s (see PARALLEL).
+
+    Notes
+    -----
+    Chunks are referenced until they are processed, so they must not be
+    modified after having been given to `update()`.
+    """
+
+    PARALLEL = not HARDWARE_CRC32
+    MAX_PENDING = 16
+    MIN_PARALLEL_SIZE = 256 * 1024
+    LANE_SIZE = 256 * 1024
+
+    def __init__(self):
+        self._crc32 = 0
+        self._pending: Deque[Tuple[Future, int]] = deque()
+
+    def _pop(self) -> None:
+        """
+        Waits for the oldest pending chunk and combines it into the CRC
+        """
+
+        future, length = self._pending.popleft()
+        self._crc32 = crc32_combine(self._crc32, future.result(), length)
+
+    def update(self, data: bytes) -> None:
+        """
+        Adds a chunk of data at the end of the checksummed stream
+        """
+
+        if not self.PARALLEL or len(data) < self.MIN_PARALLEL_SIZE:
+            self._crc32 = crc32(data, self.value)
+            return
+
+        executor = get_executor()
+        view = memoryview(data)
+
+        for start in range(0, len(view), self.LANE_SIZE):
+            lane = view[start : start + self.LANE_SIZE]
+
+            while len(self._pending) >= self.MAX_PENDING:
+                self._pop()
+
+            self._pending.append((executor.submit(crc32, lane), len(lane)))
+
+    @property
+    def value(self) -> int:
+        """
+        CRC32 of all the data received so far. Waits for pending chunks.
+        """
+
+        while self._pending:
+            self._pop()
+
+        return self._crc32
@@ -1,12 +1,14 @@
-from abc import ABC
-from struct import calcsize
-from typing import Any, Iterator, NamedTuple, Sequence
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
 
 from pendulum import DateTime
 
 from .models import (
+    DATA_DESCRIPTOR_STRUCT,
+    END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT,
     GP_LANGUAGES_ENCODING,
     GP_STREAM,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_STRUCT,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT,
     CentralDirectoryFile,
     DataDescriptor,
     EndOfCentralDirectoryRecord,
@@ -14,6 +16,8 @@ from .models import (
     Zip64EndOfCentralDirectoryLocator,
     Zip64EndOfCentralDirectoryRecord,
     Zip64ExtraField,
+    encode_text,
+    max_2,
 )
 from .storage import CompactFile
 
@@ -44,7 +48,7 @@ class ZipFile(NamedTuple):
     comment: str = ""
 
 
-class Segment(ABC):
+class Segment:
     """
     Utility class which helps to generate the various in a streaming manner:
     The get_length() method indicates the predicted length of the data without
@@ -53,6 +57,8 @@ class Segment(ABC):
     this is why there is an access to the encoder object.
     """
 
+    __slots__ = ("encoder",)
+
     def __init__(self, encoder: "ZipEncoder"):
         self.encoder = encoder
 
@@ -90,17 +96,74 @@ class Segment(ABC):
 
         raise NotImplementedError
 
+    def clear_cache(self) -> None:
+        """
+        Forgets whatever was computed from the offsets, so that they can be
+        computed again. Segments which cache anything must override it.
+        """
+
+
+class StructSegment(Segment):
+    """
+    Segment whose data is a single struct. Since the struct is needed both to
+    compute the length and to generate the data, it is packed only once and
+    then re-used.
+
+    This must only be used if the struct doesn't change between the moment
+    when offsets are computed and the moment when the data is generated
+    (which is by example not the case of the central directory since it holds
+    the CRC).
+    """
+
+    __slots__ = ("_packed",)
+
+    def __init__(self, encoder: "ZipEncoder"):
+        super().__init__(encoder)
+
+        self._packed: Optional[bytes] = None
+
+    @property
+    def _struct(self):
+        """
+        Override this to return the struct to pack
+        """
+
+        raise NotImplementedError
+
+    @property
+    def packed(self) -> bytes:
+        """
+        Packed struct, generated on first access
+        """
+
+        if self._packed is None:
+            self._packed = self._struct.pack()
+
+        return self._packed
+
+    def clear_cache(self) -> None:
+        """
+        The struct will be packed again on next access
+        """
+
+        self._packed = None
+
 
-class LocalFileHeaderSegment(Segment):
+class LocalFileHeaderSegment(StructSegment):
     """
     Represents the "local file header"
     """
 
-    def __init__(self, encoder: "ZipEncoder", file_id: int, file: ZipFile):
+    __slots__ = ("file_id", "file", "file_name")
+
+    def __init__(
+        self, encoder: "ZipEncoder", file_id: int, file: ZipFile, file_name: bytes
+    ):
         super().__init__(encoder)
 
         self.file_id = file_id
         self.file = file
+        self.file_name = file_name
 
     @property
     def _struct(self):
@@ -123,7 +186,7 @@ class LocalFileHeaderSegment(Segment):
             crc32=0,
             compressed_size=0,
             uncompressed_size=0,
-            file_name=self.file.path,
+            file_name=self.file_name,
             extra_fields=[],
         )
 
@@ -133,14 +196,14 @@ class LocalFileHeaderSegment(Segment):
         generating the data
         """
 
-        return len(self._struct.pack())
+        return len(self.packed)
 
     def get_data(self) -> Iterator[bytes]:
         """
         There's only one chunk of data here
         """
 
-        yield self._struct.pack()
+        yield self.packed
 
     def get_reference(self) -> Any:
         """
@@ -156,6 +219,8 @@ class FileDataSegment(Segment):
     The data itself.
     """
 
+    __slots__ = ("file_id", "file")
+
     def __init__(self, encoder: "ZipEncoder", file_id: int, file: ZipFile):
         super().__init__(encoder)
 
@@ -199,13 +264,16 @@ class FileDataSegment(Segment):
             is reached.
         """
 
+        # The announced size is a computed property on some storages, so it is
+        # evaluated once here rather than for every chunk
+        expected = self.file.data.compressed_size
         read = 0
 
         # noinspection PyTypeChecker
         for data in self.file.data.get_data():
             read += len(data)
 
-            if read > self.file.data.compressed_size:
+            if read > expected:
                 raise ValueError(f'Received too much data for "{self.file.path}"')
 
             if not data:
@@ -213,7 +281,7 @@ class FileDataSegment(Segment):
 
             yield data
 
-        if read != self.file.data.compressed_size:
+        if read != expected:
             raise ValueError(
                 f'Received a different file size for "{self.file.path}" '
                 f"than what was announced"
@@ -237,29 +305,35 @@ class DataDescriptorSegment(Segment):
     Long story short: this brings no information but is required for streaming.
     """
 
-    def __init__(self, encoder: "ZipEncoder", file_id: int, file: ZipFile):
+    __slots__ = ("file_id", "file", "file_data")
+
+    def __init__(
+        self,
+        encoder: "ZipEncoder",
+        file_id: int,
+        file: ZipFile,
+        file_data: FileDataSegment,
+    ):
         super().__init__(encoder)
 
         self.file_id = file_id
         self.file = file
+        self.file_data = file_data
 
     def get_length(self) -> int:
         """
         We know the length because the format is simple.
         """
 
-        return calcsize("<IIII")
+        return DATA_DESCRIPTOR_STRUCT.size
 
     def get_data(self) -> Iterator[bytes]:
         """
         Generates the data with the right offset to the file.
         """
 
-        file_data = self.encoder.get_segment(("file_data", self.file_id))
-        assert isinstance(file_data, FileDataSegment)
-
         yield DataDescriptor(
-            crc32=file_data.crc32,
+            crc32=self.file_data.crc32,
             compressed_size=self.file.data.compressed_size,
             uncompressed_size=self.file.data.uncompressed_size,
         ).pack()
@@ -277,44 +351,45 @@ class CentralDirectoryFileSegment(Segment):
     Registration of a file in the central directory
     """
 
-    def __init__(self, encoder: "ZipEncoder", file_id: int, file: ZipFile):
+    __slots__ = ("file_id", "file", "file_data", "file_name", "comment")
+
+    def __init__(
+        self,
+        encoder: "ZipEncoder",
+        file_id: int,
+        file: ZipFile,
+        file_data: FileDataSegment,
+        file_name: bytes,
+    ):
         super().__init__(encoder)
 
         self.file_id = file_id
         self.file = file
+        self.file_data = file_data
+
+        # The entry is packed twice (for its length and for its data) so the
+        # text is encoded once here
+        self.file_name = file_name
+        self.comment = encode_text(file.comment)
 
     @property
     def _struct(self):
         """
         The fun thing about ZIP64 is that you must only use it when you need
         it, meaning that you can't put the stupid extra field if nothing is
-        above the fucking limit. This gives the fancy logic with extra you can
-        see down here.
+        above the fucking limit. This gives the fancy logic with extra that
+        you can see in `Zip64ExtraField.maybe()`.
 
         Other than that, at the moment when the data of this is being read,
         the CRC is already computed so we can use it.
         """
 
-        file_data = self.encoder.get_segment(("file_data", self.file_id))
-        assert isinstance(file_data, FileDataSegment)
-
-        header_offset = self.encoder.get_offset(("file_header", self.file_id))
-
-        extra = []
-
-        if (
-            self.file.data.compressed_size > 0xFFFF
-            or self.file.data.uncompressed_size > 0xFFFF
-            or header_offset > 0xFFFF
-        ):
-            extra.append(
-                Zip64ExtraField(
-                    original_size=self.file.data.uncompressed_size,
-                    compressed_size=self.file.data.compressed_size,
-                    header_offset=header_offset,
-                    disk_start=0,
-                )
-            )
+        header_offset = self.encoder.get_file_offset("file_header", self.file_id)
+        extra = Zip64ExtraField.maybe(
+            original_size=self.file.data.uncompressed_size,
+            compressed_size=self.file.data.compressed_size,
+            header_offset=header_offset,
+        )
 
         return CentralDirectoryFile(
             version_made_by=VERSION_USED,
@@ -322,12 +397,12 @@ class CentralDirectoryFileSegment(Segment):
             general_purpose=(GP_LANGUAGES_ENCODING | GP_STREAM),
             compression_method=self.file.data.compression_method,
             last_modification=self.file.modification_date,
-            crc32=file_data.crc32,
+            crc32=self.file_data.crc32,
             compressed_size=self.file.data.compressed_size,
             uncompressed_size=self.file.data.uncompressed_size,
-            file_name=self.file.path,
+            file_name=self.file_name,
             extra_fields=extra,
-            comment=self.file.comment,
+            comment=self.comment,
             disk_number_start=0,
             internal_file_attributes=(1 if self.file.is_binary else 0),
             external_file_attributes=0,
@@ -357,7 +432,7 @@ class CentralDirectoryFileSegment(Segment):
         yield self._struct.pack()
 
 
-class Zip64EndOfCentralDirectoryRecordSegment(Segment):
+class Zip64EndOfCentralDirectoryRecordSegment(StructSegment):
     """
     Just like the ZIP version but in 64 bits. If it is not required to be
     present then it will generate an empty output. Those zip decoders are
@@ -365,21 +440,42 @@ class Zip64EndOfCentralDirectoryRecordSegment(Segment):
     apparently fuck you.
     """
 
+    __slots__ = ("_is_required",)
+
+    def __init__(self, encoder: "ZipEncoder"):
+        super().__init__(encoder)
+
+        self._is_required: Optional[bool] = None
+
     @property
-    def is_required(self):
+    def is_required(self) -> bool:
         """
         If any of the values is overflowing in the 32-bits version then we need
         to output this segment but if not we need not to. This makes the test.
+
+        It only depends on offsets which are known as soon as this segment's
+        own offset is computed, so it's evaluated only once.
         """
 
-        offset_cd = self.encoder.get_offset(("cd_file", 0))
-        offset_eocd = self.encoder.get_offset("eocd64_record")
+        if self._is_required is None:
+            offset_cd = self.encoder.get_file_offset("cd_file", 0)
+            offset_eocd = self.encoder.get_offset("eocd64_record")
 
-        return (
-            len(self.encoder.files) >= 0xFFFF
-            or offset_cd >= 0xFFFFFFFF
-            or offset_eocd >= 0xFFFFFFFF
-        )
+            self._is_required = (
+                len(self.encoder.files) >= 0xFFFF
+                or offset_cd >= 0xFFFFFFFF
+                or offset_eocd >= 0xFFFFFFFF
+            )
+
+        return self._is_required
+
+    def clear_cache(self) -> None:
+        """
+        Both the struct and the requirement depend on offsets
+        """
+
+        super().clear_cache()
+        self._is_required = None
 
     @property
     def _struct(self):
@@ -387,7 +483,7 @@ class Zip64EndOfCentralDirectoryRecordSegment(Segment):
         Generates the data
         """
 
-        offset_cd = self.encoder.get_offset(("cd_file", 0))
+        offset_cd = self.encoder.get_file_offset("cd_file", 0)
         offset_eocd = self.encoder.get_offset("eocd64_record")
 
         return Zip64EndOfCentralDirectoryRecord(
@@ -407,15 +503,16 @@ class Zip64EndOfCentralDirectoryRecordSegment(Segment):
         """
 
         if self.is_required:
-            yield self._struct.pack()
+            yield self.packed
 
     def get_length(self) -> int:
         """
-        If the segment is not required, announce a 0 length
+        If the segment is not required, announce a 0 length. Otherwise the
+        record has a fixed size.
         """
 
         if self.is_required:
-            return len(self._struct.pack())
+            return ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT.size
 
         return 0
 
@@ -427,22 +524,29 @@ class Zip64EndOfCentralDirectoryRecordSegment(Segment):
         return "eocd64_record"
 
 
-class Zip64EndOfCentralDirectoryLocatorSegment(Segment):
+class Zip64EndOfCentralDirectoryLocatorSegment(StructSegment):
     """
     That segment is just there to locate the 64-bits central directory.
     Happily, the 64-bits directory does not always appear, so this must also
     not appear using the same condition.
     """
 
+    __slots__ = ("record",)
+
+    def __init__(
+        self, encoder: "ZipEncoder", record: Zip64EndOfCentralDirectoryRecordSegment
+    ):
+        super().__init__(encoder)
+
+        self.record = record
+
     @property
-    def is_required(self):
+    def is_required(self) -> bool:
         """
         Checks if the 64 directory appears or not
         """
 
-        record = self.encoder.get_segment("eocd64_record")
-        assert isinstance(record, Zip64EndOfCentralDirectoryRecordSegment)
-        return record.is_required
+        return self.record.is_required
 
     @property
     def _struct(self):
@@ -471,7 +575,7 @@ class Zip64EndOfCentralDirectoryLocatorSegment(Segment):
         """
 
         if self.is_required:
-            return calcsize("<IIQI")
+            return ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_STRUCT.size
 
         return 0
 
@@ -481,17 +585,19 @@ class Zip64EndOfCentralDirectoryLocatorSegment(Segment):
         """
 
         if self.is_required:
-            yield self._struct.pack()
+            yield self.packed
 
 
-class EndOfCentralDirectoryRecordSegment(Segment):
+class EndOfCentralDirectoryRecordSegment(StructSegment):
     """
     Indicates the end of central directory.
     """
 
+    __slots__ = ()
+
     @property
     def _struct(self):
-        offset_cd = self.encoder.get_offset(("cd_file", 0))
+        offset_cd = self.encoder.get_file_offset("cd_file", 0)
         offset_eocd = self.encoder.get_offset("eocd64_record")
 
         return EndOfCentralDirectoryRecord(
@@ -505,10 +611,19 @@ class EndOfCentralDirectoryRecordSegment(Segment):
         )
 
     def get_data(self) -> Iterator[bytes]:
-        yield self._struct.pack()
+        yield self.packed
 
     def get_length(self) -> int:
-        return len(self._struct.pack())
+        """
+        Fixed part plus the comment. The comment length is checked here so
+        that a comment too long fails before streaming starts.
+        """
+
+        comment = encode_text(self.encoder.comment)
+
+        return END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT.size + max_2(
+            len(comment), prevent=True
+        )
 
     def get_reference(self) -> Any:
         return "eocd"
@@ -516,15 +631,15 @@ class EndOfCentralDirectoryRecordSegment(Segment):
 
 class ZipEncoder:
     """
-    Encodes zips while streaming. There is basically 3 stages
+    Encodes zips while streaming. There is basically 2 stages
 
-    1. make_segments() generates all the segments required for this zip
-    2. compute_offsets() will compute the offset of all segments based on the
-       length of other segments but without generating the data itself
-    3. get_data() iterates through all the data
+    1. make_segments() generates all the segments required for this zip and
+       computes the offset of each segment based on the length of previous
+       segments but without generating the data itself
+    2. get_data() iterates through all the data
 
-    There is a shortcut function prepare() that does step 1 and 2. After this
-    the file_size attribute is set with the final file size, which can be
+    There is a shortcut function prepare() that does step 1. After this the
+    file_size attribute is set with the final file size, which can be
     announced over HTTP by example.
 
     This all works because the data is uncompressed. The choice of not
@@ -550,6 +665,11 @@ class ZipEncoder:
     efficient.
     """
 
+    # Chunks smaller than this (headers, descriptors, etc) are grouped before
+    # being yielded, up to GROUP_SIZE bytes
+    SMALL_CHUNK_SIZE = 4 * 1024
+    GROUP_SIZE = 64 * 1024
+
     def __init__(self, files: Sequence[ZipFile], comment: str = ""):
         if not files:
             raise ValueError("Unexpected empty files list")
@@ -559,6 +679,8 @@ class ZipEncoder:
         self.segments = None
         self.offsets = {}
         self.indexed_segments = {}
+        self.file_offsets: Dict[str, List[int]] = {}
+        self.indexed_file_segments: Dict[str, List[Segment]] = {}
         self.file_size = 0
 
     def get_segment(self, reference: Any) -> Segment:
@@ -581,6 +703,14 @@ class ZipEncoder:
             If the reference is not found
         """
 
+        if isinstance(reference, tuple):
+            kind, file_id = reference
+
+            try:
+                return self.indexed_file_segments[kind][file_id]
+            except IndexError:
+                raise KeyError(reference)
+
         return self.indexed_segments[reference]
 
     def get_offset(self, reference: Any) -> int:
@@ -603,8 +733,71 @@ class ZipEncoder:
             If the reference is not found
         """
 
+        if isinstance(reference, tuple):
+            kind, file_id = reference
+
+            try:
+                return self.file_offsets[kind][file_id]
+            except IndexError:
+                raise KeyError(reference)
+
         return self.offsets[reference]
 
+    def get_file_offset(self, kind: str, file_id: int) -> int:
+        """
+        Shortcut to get the offset of a per-file segment, which is referenced
+        by a `(kind, file_id)` tuple. This avoids building the tuple.
+
+        Parameters
+        ----------
+        kind
+            First item of the reference (like "file_header")
+        file_id
+            ID of the file
+
+        Returns
+        -------
+        The offset of the reference
+        """
+
+        return self.file_offsets[kind][file_id]
+
+    def _add_segment(self, segment: Segment, offset: int) -> int:
+        """
+        Registers a segment at a given offset so that other segments can find
+        it.
+
+        Parameters
+        ----------
+        segment
+            Segment to register
+        offset
+            Offset of this segment
+
+        Returns
+        -------
+        The offset of the next segment
+        """
+
+        reference = segment.get_reference()
+
+        # Per-file references are (kind, file_id) tuples which are stored in
+        # lists indexed by file ID rather than hashed into a dict
+        if isinstance(reference, tuple):
+            kind, file_id = reference
+
+            if kind not in self.file_offsets:
+                self.file_offsets[kind] = [0] * len(self.files)
+                self.indexed_file_segments[kind] = [None] * len(self.files)
+
+            self.file_offsets[kind][file_id] = offset
+            self.indexed_file_segments[kind][file_id] = segment
+        else:
+            self.offsets[reference] = offset
+            self.indexed_segments[reference] = segment
+
+        return offset + segment.get_length()
+
     def make_segments(self) -> None:
         """
         Generates the list of segments according to the zip specification. It's
@@ -612,40 +805,63 @@ class ZipEncoder:
 
         Some ZIP64 segments are not mandatory but this is their responsibility
         to have a 0-length output when we don't need them.
+
+        Since the length of each segment only depends on the segments before
+        it, offsets are computed in the same pass and the file_size attribute
+        is set at the end.
         """
 
         out = []
+        files_data = []
+        file_names = []
+        offset = 0
+
+        def add(segment: Segment) -> None:
+            nonlocal offset
+            out.append(segment)
+            offset = self._add_segment(segment, offset)
 
         for i, file in enumerate(self.files):
-            out += [
-                LocalFileHeaderSegment(self, i, file),
-                FileDataSegment(self, i, file),
-                DataDescriptorSegment(self, i, file),
-            ]
+            # The file name is encoded once for both its local header and its
+            # central directory entry
+            file_name = encode_text(file.path)
+            file_data = FileDataSegment(self, i, file)
+            files_data.append(file_data)
+            file_names.append(file_name)
+
+            add(LocalFileHeaderSegment(self, i, file, file_name))
+            add(file_data)
+            add(DataDescriptorSegment(self, i, file, file_data))
 
         for i, file in enumerate(self.files):
-            out.append(CentralDirectoryFileSegment(self, i, file))
+            add(
+                CentralDirectoryFileSegment(self, i, file, files_data[i], file_names[i])
+            )
+
+        eocd64_record = Zip64EndOfCentralDirectoryRecordSegment(self)
 
-        out += [
-            Zip64EndOfCentralDirectoryRecordSegment(self),
-            Zip64EndOfCentralDirectoryLocatorSegment(self),
-            EndOfCentralDirectoryRecordSegment(self),
-        ]
+        add(eocd64_record)
+        add(Zip64EndOfCentralDirectoryLocatorSegment(self, eocd64_record))
+        add(EndOfCentralDirectoryRecordSegment(self))
 
         self.segments = out
+        self.file_size = offset
 
     def compute_offsets(self) -> None:
         """
         Computes all the offsets of all the segments by adding the length of
-        all segments.
+        all segments. This is already done by make_segments(), so this is only
+        useful if you need to compute them again, in which case the values
+        that segments cached from the previous offsets are cleared.
         """
 
         offset = 0
 
         for segment in self.segments:
-            self.offsets[segment.get_reference()] = offset
-            self.indexed_segments[segment.get_reference()] = segment
-            offset += segment.get_length()
+            segment.clear_cache()
+
+        for segment in self.segments:
+            offset = self._add_segment(segment, offset)
 
         self.file_size = offset
 
@@ -657,13 +873,32 @@ class ZipEncoder:
         """
 
         self.make_segments()
-        self.compute_offsets()
 
     def get_data(self) -> Iterator[bytes]:
         """
         Returns byte strings of various length forming the data of the zip.
+
+        Small chunks are grouped together until a big chunk comes (or until
+        the group is big enough) so that the consumer doesn't have to do one
+        write per header.
         """
 
+        group = bytearray()
+
         for segment in self.segments:
             for chunk in segment.get_data():
-                yield chunk
+                if len(chunk) < self.SMALL_CHUNK_SIZE:
+                    group += chunk
+
+                    if len(group) >= self.GROUP_SIZE:
+                        yield bytes(group)
+                        group.clear()
+                else:
+                    if group:
+                        yield bytes(group)
+                        group.clear()
+
+                    yield chunk
+
+        if group:
+            yield bytes(group)
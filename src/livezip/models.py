@@ -1,15 +1,36 @@
 from enum import Enum
-from struct import calcsize, pack
+from functools import lru_cache
+from struct import Struct, calcsize
+from time import gmtime
 from typing import List, NamedTuple, Tuple, Union
 
-from pendulum import DateTime, parse
+from pendulum import UTC, DateTime, datetime
 
-DOS_START = parse("1980-01-01T00:00:00.000000Z")
-DOS_STOP = parse("2099-12-31T23:59:59.999999Z")
+# Built directly rather than parsed from a string, which is slow at import
+DOS_START = datetime(1980, 1, 1, tz=UTC)
+DOS_STOP = datetime(2099, 12, 31, 23, 59, 59, 999999, tz=UTC)
+
+DOS_START_TIMESTAMP = DOS_START.timestamp()
+DOS_STOP_TIMESTAMP = DOS_STOP.timestamp()
 
 GP_LANGUAGES_ENCODING = 1 << 11
 GP_STREAM = 1 << 3
 
+# Fixed-size part of the records. Formats are compiled once here instead of
+# being parsed again at each pack() call.
+LOCAL_FILE_HEADER_STRUCT = Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR_STRUCT = Struct("<IIII")
+CENTRAL_DIRECTORY_FILE_STRUCT = Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT = Struct("<IQHHIIQQQQ")
+ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_STRUCT = Struct("<IIQI")
+END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT = Struct("<IHHHHIIH")
+
+# The ZIP64 end of central directory record holds its own size, not counting
+# the signature and the size field themselves (so 44 bytes)
+ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_SIZE = (
+    ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT.size - calcsize("<IQ")
+)
+
 
 def make_dos_date_time(date: DateTime) -> Tuple[int, int]:
     """
@@ -28,20 +49,36 @@ def make_dos_date_time(date: DateTime) -> Tuple[int, int]:
         in the UTC time zone.
     """
 
-    date = date.in_timezone("UTC")
-    date = max(DOS_START, date)
-    date = min(DOS_STOP, date)
+    return _make_dos_date_time(date.timestamp())
+
+
+@lru_cache(maxsize=1024)
+def _make_dos_date_time(timestamp: float) -> Tuple[int, int]:
+    """
+    Encodes a UNIX timestamp into the DOS binary format, in UTC. See
+    `make_dos_date_time()`.
+
+    The date of each file is encoded in its local header and in its central
+    directory entry, so results are cached. They are keyed by timestamp since
+    two date/time objects can compare equal while being different instants
+    (by example during a DST fold).
+    """
+
+    timestamp = min(max(timestamp, DOS_START_TIMESTAMP), DOS_STOP_TIMESTAMP)
+    date = gmtime(timestamp)
 
-    dos_date = (date.year - 1980) << 9 | date.month << 5 | date.day
-    dos_time = date.hour << 11 | date.minute << 5 | (date.second // 2)
+    dos_date = (date.tm_year - 1980) << 9 | date.tm_mon << 5 | date.tm_mday
+    dos_time = date.tm_hour << 11 | date.tm_min << 5 | (date.tm_sec // 2)
 
     return dos_time, dos_date
 
 
+@lru_cache(maxsize=16)
 def encode_version(major: int, minor: int):
     """
     Encodes the version number into something that the binary ZIP format
-    understands.
+    understands. Only a couple of versions are ever used so results are
+    cached.
 
     Parameters
     ----------
@@ -74,6 +111,28 @@ def encode_version(major: int, minor: int):
     return version
 
 
+def encode_text(text: Union[str, bytes]) -> bytes:
+    """
+    Encodes a file name or a comment in UTF-8. Text which is already encoded
+    is returned as-is, which allows to encode once a file name that appears in
+    several headers.
+
+    Parameters
+    ----------
+    text
+        Text to encode, or its UTF-8 encoding
+
+    Returns
+    -------
+    UTF-8 encoded text
+    """
+
+    if isinstance(text, bytes):
+        return text
+
+    return text.encode("utf-8")
+
+
 def max_o(x, n, prevent=False):
     """
     Ensures that x fits on n bits (not bytes).
@@ -100,49 +159,74 @@ def max_o(x, n, prevent=False):
         If the value overflows and prevent is true
     """
 
-    if x >= 1 << n:
+    limit = (1 << n) - 1
+
+    if x > limit:
         if prevent:
             raise ValueError
-        else:
-            return (1 << n) - 1
+
+        return limit
 
     return x
 
 
 def max_2(x, prevent=False):
     """
-    Fits x in 2 bytes (not bits).
+    Fits x in 2 bytes (not bits), like the name and extra lengths of each
+    file header. Same as `max_o(x, 16, prevent)` with the limit inlined.
 
     See Also
     --------
     max_o
     """
 
-    return max_o(x, 16, prevent)
+    if x > 0xFFFF:
+        if prevent:
+            raise ValueError
+
+        return 0xFFFF
+
+    return x
 
 
 def max_4(x, prevent=False):
     """
-    Fits x in 4 bytes (not bits).
+    Fits x in 4 bytes (not bits), like the sizes and offsets which every
+    file header and data descriptor holds. Same as `max_o(x, 32, prevent)`
+    with the limit inlined.
 
     See Also
     --------
     max_o
     """
 
-    return max_o(x, 32, prevent)
+    if x > 0xFFFFFFFF:
+        if prevent:
+            raise ValueError
+
+        return 0xFFFFFFFF
+
+    return x
 
 
 def max_8(x, prevent=False):
     """
-    Fits x in 8 bytes (not bits).
+    Fits x in 8 bytes (not bits), for the 64 bits fields of the ZIP64
+    records and extra field. Same as `max_o(x, 64, prevent)`, kept alongside
+    `max_2()` and `max_4()` for consistency.
 
     See Also
     --------
     max_o
     """
 
-    return max_o(x, 64, prevent)
+    if x > 0xFFFFFFFFFFFFFFFF:
+        if prevent:
+            raise ValueError
+
+        return 0xFFFFFFFFFFFFFFFF
+
+    return x
 
 
 class CompressionMethod(Enum):
@@ -154,6 +238,30 @@ class CompressionMethod(Enum):
     deflate = 8
 
 
+def _make_zip64_layouts() -> List[Struct]:
+    """
+    Compiles the format of the ZIP64 extra field for each combination of
+    present fields. The index is a bit mask with, in order, the original size,
+    the compressed size, the header offset and the disk start.
+    """
+
+    layouts = []
+
+    for mask in range(16):
+        fmt = "<HH"
+
+        for bit, field_fmt in enumerate("QQQI"):
+            if mask & (1 << bit):
+                fmt += field_fmt
+
+        layouts.append(Struct(fmt))
+
+    return layouts
+
+
+_ZIP64_LAYOUTS = _make_zip64_layouts()
+
+
 class Zip64ExtraField(NamedTuple):
     """
     Extra field which holds the 64 bits information about a file
@@ -168,40 +276,102 @@ class Zip64ExtraField(NamedTuple):
     header_offset: int
     disk_start: int
 
+    @classmethod
+    def maybe(
+        cls,
+        original_size: int,
+        compressed_size: int,
+        header_offset: int,
+        disk_start: int = 0,
+    ) -> List["Zip64ExtraField"]:
+        """
+        The extra field must only be there when one of the values doesn't fit
+        in its regular field. This returns the list of extra fields to use,
+        which is empty for most files, so nothing has to be built for them.
+
+        Parameters
+        ----------
+        original_size
+            Uncompressed size of the file
+        compressed_size
+            Compressed size of the file
+        header_offset
+            Offset of the local file header
+        disk_start
+            Number of the disk on which the file starts
+
+        Returns
+        -------
+        Either an empty list or a list with the extra field
+        """
+
+        if (
+            original_size < 0xFFFFFFFF
+            and compressed_size < 0xFFFFFFFF
+            and header_offset < 0xFFFFFFFF
+            and disk_start < 0xFFFF
+        ):
+            return []
+
+        return [cls(original_size, compressed_size, header_offset, disk_start)]
+
     def pack(self):
         """
         Only the fields that need to be in 64 bits must be present, so the
         logic here is a bit peculiar since we only add the fields that are
         overflowing in 32-bits (thus we need to check if they overflow and then
-        append them to the output).
+        append them to the output). A value equal to the 32-bits maximum also
+        counts since the maximum is the marker for "see the ZIP64 field", in
+        the same way as in the central directory (see section 4.5.3 of
+        zip_spec.txt). The layout for each combination of fields is compiled
+        in advance.
         """
 
-        fields = [
-            (self.original_size, "Q", 32, 64),
-            (self.compressed_size, "Q", 32, 64),
-            (self.header_offset, "Q", 32, 64),
-            (self.disk_start, "I", 16, 32),
-        ]
+        mask = 0
+        data = []
 
-        fmt = "<HH"
-        data = [0x0001, 0x0]
+        if self.original_size >= 0xFFFFFFFF:
+            mask |= 1
+            data.append(max_8(self.original_size, prevent=True))
 
-        for value, field_fmt, length, length_64 in fields:
-            if value >= (1 << length):
-                fmt += field_fmt
-                data.append(max_o(value, length_64, prevent=True))
+        if self.compressed_size >= 0xFFFFFFFF:
+            mask |= 2
+            data.append(max_8(self.compressed_size, prevent=True))
 
-        data[1] = calcsize(fmt) - calcsize("<HH")
+        if self.header_offset >= 0xFFFFFFFF:
+            mask |= 4
+            data.append(max_8(self.header_offset, prevent=True))
 
-        return pack(fmt, *data)
+        if self.disk_start >= 0xFFFF:
+            mask |= 8
+            data.append(max_4(self.disk_start, prevent=True))
+
+        layout = _ZIP64_LAYOUTS[mask]
+
+        return layout.pack(0x0001, layout.size - 4, *data)
 
 
 ExtraField = Union[Zip64ExtraField]
 
 
+def pack_extra_fields(extra_fields: List[ExtraField]) -> bytes:
+    """
+    Packs a list of extra fields. There is at most one of them in practice,
+    so that case doesn't go through a generator and a join.
+    """
+
+    if not extra_fields:
+        return b""
+
+    if len(extra_fields) == 1:
+        return extra_fields[0].pack()
+
+    return b"".join([x.pack() for x in extra_fields])
+
+
 class LocalFileHeader(NamedTuple):
     """
-    Local file descriptor
+    Local file descriptor. Text fields can also be given already encoded in UTF-8.
 
     See Also
     --------
@@ -215,29 +385,48 @@ class LocalFileHeader(NamedTuple):
     crc32: int
     compressed_size: int
     uncompressed_size: int
-    file_name: str
+    file_name: Union[str, bytes]
     extra_fields: List[ExtraField]
 
     def pack(self) -> bytes:
-        extra = b"".join(x.pack() for x in self.extra_fields)
-        file_name = self.file_name.encode("utf-8")
+        return _LOCAL_FILE_HEADER_PACKERS[self.compression_method](self)
 
-        data = [
+
+def _make_local_file_header_packer(method: CompressionMethod):
+    """
+    Generates a packing function for local file headers of a given compression
+    method, with the method's value and the struct's pack function bound in
+    advance since there is one header to pack for each file.
+    """
+
+    pack_fixed = LOCAL_FILE_HEADER_STRUCT.pack
+    method_value = method.value
+
+    def pack_local_file_header(header: LocalFileHeader) -> bytes:
+        extra = pack_extra_fields(header.extra_fields)
+        file_name = encode_text(header.file_name)
+
+        out = pack_fixed(
             0x04034B50,
-            encode_version(*self.version_needed),
-            self.general_purpose,
-            self.compression_method.value,
-            *make_dos_date_time(self.last_modification),
-            self.crc32,
-            max_4(self.compressed_size),
-            max_4(self.uncompressed_size),
+            encode_version(*header.version_needed),
+            header.general_purpose,
+            method_value,
+            *make_dos_date_time(header.last_modification),
+            header.crc32,
+            max_4(header.compressed_size),
+            max_4(header.uncompressed_size),
             max_2(len(file_name), prevent=True),
             max_2(len(extra), prevent=True),
-        ]
+        )
 
-        out = pack("<IHHHHHIIIHH", *data)
+        return b"".join((out, file_name, extra))
 
-        return out + file_name + extra
+    return pack_local_file_header
+
+
+_LOCAL_FILE_HEADER_PACKERS = {
+    method: _make_local_file_header_packer(method) for method in CompressionMethod
+}
 
 
 class DataDescriptor(NamedTuple):
@@ -254,8 +443,7 @@ class DataDescriptor(NamedTuple):
     uncompressed_size: int
 
     def pack(self) -> bytes:
-        return pack(
-            "<IIII",
+        return DATA_DESCRIPTOR_STRUCT.pack(
             0x08074B50,
             self.crc32,
             max_4(self.compressed_size),
@@ -265,7 +453,7 @@ class DataDescriptor(NamedTuple):
 
 class CentralDirectoryFile(NamedTuple):
     """
-    Central directory
+    Central directory. Text fields can also be given already encoded in UTF-8.
 
     See Also
     --------
@@ -280,20 +468,20 @@ class CentralDirectoryFile(NamedTuple):
     crc32: int
     compressed_size: int
     uncompressed_size: int
-    file_name: str
+    file_name: Union[str, bytes]
     extra_fields: List[ExtraField]
-    comment: str
+    comment: Union[str, bytes]
     disk_number_start: int
     internal_file_attributes: int
     external_file_attributes: int
     relative_offset_of_local_header: int
 
     def pack(self) -> bytes:
-        extra = b"".join(x.pack() for x in self.extra_fields)
-        file_name = self.file_name.encode("utf-8")
-        comment = self.comment.encode("utf-8")
+        extra = pack_extra_fields(self.extra_fields)
+        file_name = encode_text(self.file_name)
+        comment = encode_text(self.comment)
 
-        data = [
+        out = CENTRAL_DIRECTORY_FILE_STRUCT.pack(
             0x02014B50,
             encode_version(*self.version_made_by),
             encode_version(*self.version_needed_to_extract),
@@ -310,11 +498,9 @@ class CentralDirectoryFile(NamedTuple):
             self.internal_file_attributes,
             self.external_file_attributes,
             max_4(self.relative_offset_of_local_header),
-        ]
-
-        out = pack("<IHHHHHHIIIHHHHHII", *data)
+        )
 
-        return out + file_name + extra + comment
+        return b"".join((out, file_name, extra, comment))
 
 
 class Zip64EndOfCentralDirectoryRecord(NamedTuple):
@@ -336,11 +522,9 @@ class Zip64EndOfCentralDirectoryRecord(NamedTuple):
     central_directory_offset: int
 
     def pack(self) -> bytes:
-        fmt = "<IQHHIIQQQQ"
-
-        data = [
+        return ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT.pack(
             0x06064B50,
-            calcsize(fmt) - calcsize("<IQ"),
+            ZIP64_END_OF_CENTRAL_DIRECTORY_RECORD_SIZE,
             encode_version(*self.version_made_by),
             encode_version(*self.version_needed_to_extract),
             max_4(self.number_of_this_disk, prevent=True),
@@ -349,9 +533,7 @@ class Zip64EndOfCentralDirectoryRecord(NamedTuple):
             max_8(self.number_of_entries, prevent=True),
             max_8(self.size_of_central_directory, prevent=True),
             max_8(self.central_directory_offset, prevent=True),
-        ]
-
-        return pack(fmt, *data)
+        )
 
 
 class Zip64EndOfCentralDirectoryLocator(NamedTuple):
@@ -368,14 +550,12 @@ class Zip64EndOfCentralDirectoryLocator(NamedTuple):
     number_of_disks: int
 
     def pack(self) -> bytes:
-        data = [
+        return ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_STRUCT.pack(
             0x07064B50,
             max_4(self.number_of_the_disk_with_start, prevent=True),
             max_8(self.offset_to_end_of_central_directory_record, prevent=True),
             max_4(self.number_of_disks, prevent=True),
-        ]
-
-        return pack("<IIQI", *data)
+        )
 
 
 class EndOfCentralDirectoryRecord(NamedTuple):
@@ -393,12 +573,12 @@ class EndOfCentralDirectoryRecord(NamedTuple):
     number_of_entries: int
     size_of_central_directory: int
     central_directory_offset: int
-    comment: str
+    comment: Union[str, bytes]
 
     def pack(self) -> bytes:
-        comment = self.comment.encode("utf-8")
+        comment = encode_text(self.comment)
 
-        data = [
+        out = END_OF_CENTRAL_DIRECTORY_RECORD_STRUCT.pack(
             0x06054B50,
             max_2(self.number_of_this_disk),
             max_2(self.number_of_the_disk_with_start),
@@ -407,8 +587,6 @@ class EndOfCentralDirectoryRecord(NamedTuple):
             max_4(self.size_of_central_directory),
             max_4(self.central_directory_offset),
             max_2(len(comment), prevent=True),
-        ]
-
-        out = pack("<IHHHHIIH", *data)
+        )
 
         return out + comment
@@ -1,10 +1,12 @@
+import os
+import sys
 from abc import ABC, abstractmethod
-from struct import calcsize, pack
+from struct import Struct
 from typing import Iterator
-from zlib import crc32
 
+from .crc import ParallelCrc32
 from .models import CompressionMethod
-from .stream import DataStream
+from .stream import DataStream, FileStream
 
 
 class CompactFile(ABC):
@@ -62,7 +64,8 @@ class CompactFile(ABC):
     @abstractmethod
     def get_data(self) -> Iterator[bytes]:
         """
-        Iterates over data chunks of arbitrary length
+        Iterates over data chunks of arbitrary length. Chunks must be `bytes`
+        since they end up in the output of `ZipEncoder.get_data()`.
         """
 
         raise NotImplementedError
@@ -82,12 +85,16 @@ class DeflateStore(CompactFile):
     """
 
     BLOCK_SIZE = 0xFFFF
-    BLOCK_HEADER = "<BHH"
+    BLOCK_HEADER = Struct("<BHH")
+
+    # Blocks are read and yielded by groups of that many, which avoids going
+    # through the whole Python machinery once every 64 Kio
+    BLOCKS_PER_CHUNK = 16
 
     def __init__(self, data: DataStream, size: int):
         self.data = data
         self._size = size
-        self._crc32 = 0
+        self._crc32 = ParallelCrc32()
 
     @property
     def blocks(self) -> int:
@@ -121,7 +128,7 @@ class DeflateStore(CompactFile):
         header
         """
 
-        return self.blocks * calcsize(self.BLOCK_HEADER) + self._size
+        return self.blocks * self.BLOCK_HEADER.size + self._size
 
     @property
     def uncompressed_size(self) -> int:
@@ -134,10 +141,10 @@ class DeflateStore(CompactFile):
     @property
     def crc32(self) -> int:
         """
-        The CRC32 is computed during `get_data()`
+        The CRC32 is computed in background during `get_data()`
         """
 
-        return self._crc32
+        return self._crc32.value
 
     def get_data(self) -> Iterator[bytes]:
         """
@@ -145,23 +152,42 @@ class DeflateStore(CompactFile):
         """
 
         last_offset = (self.blocks - 1) * self.BLOCK_SIZE
+        chunk_size = self.BLOCK_SIZE * self.BLOCKS_PER_CHUNK
 
         self.data.open()
 
         try:
-            for i in range(0, self.uncompressed_size, self.BLOCK_SIZE):
-                if i == last_offset:
-                    block_format = 0b00000001
-                else:
-                    block_format = 0b00000000
+            for chunk_offset in range(0, self.uncompressed_size, chunk_size):
+                data_size = min(chunk_size, self._size - chunk_offset)
+                data = self.data.read(data_size)
+
+                if len(data) != data_size:
+                    raise ValueError("Data stream is shorter than announced")
+
+                # The CRC is updated for the whole chunk at once so that it's
+                # big enough to be computed in background
+                self._crc32.update(data)
+
+                view = memoryview(data)
+                parts = []
 
-                data = self.data.read(self.BLOCK_SIZE)
-                args = [block_format, len(data), len(data) ^ self.BLOCK_SIZE]
-                header = pack(self.BLOCK_HEADER, *args)
+                for i in range(0, data_size, self.BLOCK_SIZE):
+                    if chunk_offset + i == last_offset:
+                        block_format = 0b00000001
+                    else:
+                        block_format = 0b00000000
 
-                self._crc32 = crc32(data, self._crc32)
+                    block = view[i : i + self.BLOCK_SIZE]
+                    length = len(block)
 
-                yield header + data
+                    # The header holds LEN followed by its one's complement
+                    parts.append(
+                        self.BLOCK_HEADER.pack(block_format, length, length ^ 0xFFFF)
+                    )
+                    parts.append(block)
+
+                # Headers and data are copied only once, into a single bytes
+                yield b"".join(parts)
         finally:
             self.data.close()
             del self.data
@@ -172,12 +198,14 @@ class Store(CompactFile):
     Just stores the raw uncompressed file
     """
 
-    READ_SIZE = 1024 ** 2  # 1 Mio
+    # Big enough that the CRC and the consumer are called once for several
+    # Mio of data, rather than at each Mio
+    READ_SIZE = 4 * 1024 ** 2  # 4 Mio
 
     def __init__(self, data: DataStream, size: int):
         self.data = data
         self._size = size
-        self._crc32 = 0
+        self._crc32 = ParallelCrc32()
 
     @property
     def compressed_size(self) -> int:
@@ -194,10 +222,10 @@ class Store(CompactFile):
     @property
     def crc32(self) -> int:
         """
-        Computed during get_data()
+        Computed in background during get_data()
         """
 
-        return self._crc32
+        return self._crc32.value
 
     def get_data(self) -> Iterator[bytes]:
         self.data.open()
@@ -205,8 +233,73 @@ class Store(CompactFile):
         try:
             for _ in range(0, self.uncompressed_size, self.READ_SIZE):
                 data = self.data.read(self.READ_SIZE)
-                self._crc32 = crc32(data, self._crc32)
+                self._crc32.update(data)
                 yield data
         finally:
             self.data.close()
             del self.data
+
+    @property
+    def can_send_data(self) -> bool:
+        """
+        Indicates if `send_data()` can be used instead of `get_data()`. This
+        is only the case on Linux, since other systems can only `sendfile()`
+        into a socket.
+        """
+
+        return (
+            sys.platform.startswith("linux")
+            and hasattr(os, "sendfile")
+            and isinstance(self.data, FileStream)
+        )
+
+    def send_data(self, out_fd: int) -> None:
+        """
+        Alternative to `get_data()` where the file is copied to `out_fd` by the
+        kernel using `os.sendfile()`, so the data isn't written from user
+        space. The CRC is computed from the same ranges, read with
+        `os.pread()` right before they are sent.
+
+        Only available if `can_send_data` is true. The file must not be
+        modified while it's being sent.
+
+        Parameters
+        ----------
+        out_fd
+            File descriptor to write into, at its current position
+
+        Raises
+        ------
+        ValueError
+            If the size of the file is not the announced size
+        """
+
+        self.data.open()
+
+        try:
+            in_fd = self.data.fileno()
+
+            if os.fstat(in_fd).st_size != self._size:
+                raise ValueError(
+                    f"File size is different from the announced {self._size} bytes"
+                )
+
+            for offset in range(0, self._size, self.READ_SIZE):
+                end = min(offset + self.READ_SIZE, self._size)
+                data = os.pread(in_fd, end - offset, offset)
+
+                if len(data) != end - offset:
+                    raise ValueError("File was truncated while sending")
+
+                self._crc32.update(data)
+
+                while offset < end:
+                    sent = os.sendfile(out_fd, in_fd, offset, end - offset)
+
+                    if not sent:
+                        raise ValueError("File was truncated while sending")
+
+                    offset += sent
+        finally:
+            self.data.close()
+            del self.data
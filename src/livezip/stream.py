@@ -1,6 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Callable, Optional, Text, Union
-from urllib.request import urlopen
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from threading import Lock
+from typing import BinaryIO, Callable, Dict, List, Optional, Text, Tuple, Union
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import __version__ as urllib_version
+from urllib.request import getproxies, urlopen
 
 
 class DataStream(ABC):
@@ -45,6 +50,67 @@ class DataStream(ABC):
         raise NotImplementedError
 
 
+class ConnectionPool:
+    """
+    Keeps HTTP connections alive between requests so that streaming many
+    files from the same host only pays for the TCP and TLS handshakes once.
+    Connections are returned to the pool only if their response was read
+    entirely.
+    """
+
+    #: Maximum number of idle connections kept for each host
+    MAX_IDLE = 8
+
+    def __init__(self):
+        self._idle: Dict[Tuple[Text, Text], List[HTTPConnection]] = {}
+        self._lock = Lock()
+
+    def get(self, scheme: Text, host: Text, timeout: float) -> HTTPConnection:
+        """
+        Returns an idle connection to that host or a new one
+
+        Parameters
+        ----------
+        scheme
+            Either "http" or "https"
+        host
+            Host and optionally port of the server
+        timeout
+            Timeout of new connections, in seconds
+        """
+
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+
+            if idle:
+                return idle.pop()
+
+        if scheme == "https":
+            return HTTPSConnection(host, timeout=timeout)
+
+        return HTTPConnection(host, timeout=timeout)
+
+    def put(self, scheme: Text, host: Text, connection: HTTPConnection) -> None:
+        """
+        Gives back a connection whose response has been entirely read
+        """
+
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+
+            if len(idle) < self.MAX_IDLE:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+
+_pool = ConnectionPool()
+
+#: Headers of pooled requests, which mimic the ones of urlopen()
+POOLED_HEADERS = {"User-Agent": f"Python-urllib/{urllib_version}"}
+
+
 class UrlStream(DataStream):
     """
     Streams the content found at the specified URL.
@@ -66,13 +132,86 @@ class UrlStream(DataStream):
 
         self.url = url
         self.r = None
+        self._connection: Optional[HTTPConnection] = None
+        self._key: Optional[Tuple[Text, Text]] = None
 
     def open(self) -> None:
         """
-        Opens the specified URL for reading
+        Opens the specified URL for reading. Plain HTTP(S) requests go through
+        a pool of kept-alive connections, with the same User-Agent as
+        `urlopen()`. Anything this doesn't handle (proxies, other schemes) is
+        left to `urlopen()`.
+
+        Notes
+        -----
+        Errors are raised like `urlopen()` would: connection failures as
+        `URLError` and error statuses as `HTTPError`. Redirections however are
+        left to `urlopen()`, which means that the server receives two GET
+        requests in that case.
+        """
+
+        self.r = None
+        self._connection = None
+        self._key = None
+
+        url = self.url()
+        parts = urlsplit(url)
+
+        if parts.scheme in ("http", "https") and parts.scheme not in getproxies():
+            self._open_pooled(url, parts.scheme, parts.netloc, parts.path, parts.query)
+
+        if self.r is None:
+            self.r = urlopen(url, timeout=self.TIMEOUT)
+
+    def _open_pooled(
+        self, url: Text, scheme: Text, host: Text, path: Text, query: Text
+    ):
+        """
+        Tries to send the request on a pooled connection. A connection that
+        was idle might have been closed by the server in the meantime, in
+        which case the request is retried once on a new connection.
+
+        If the answer is a redirection then `self.r` is left to `None`.
         """
 
-        self.r = urlopen(self.url(), timeout=self.TIMEOUT)
+        target = (path or "/") + (f"?{query}" if query else "")
+
+        for attempt in range(2):
+            connection = _pool.get(scheme, host, self.TIMEOUT)
+
+            try:
+                connection.request("GET", target, headers=POOLED_HEADERS)
+                response = connection.getresponse()
+            except (HTTPException, ConnectionError) as e:
+                connection.close()
+
+                if attempt == 0:
+                    continue
+
+                if isinstance(e, OSError):
+                    raise URLError(e) from e
+
+                raise
+            except OSError as e:
+                connection.close()
+                raise URLError(e) from e
+
+            if 300 <= response.status < 400:
+                response.close()
+                connection.close()
+                return
+
+            if response.status >= 400:
+                # The connection stays open for the body of the error, it's
+                # not given back to the pool though
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers, response
+                )
+
+            self.r = response
+            self._connection = connection
+            self._key = (scheme, host)
+            return
 
     def read(self, size: int) -> bytes:
         """
@@ -92,10 +231,21 @@ class UrlStream(DataStream):
 
     def close(self):
         """
-        Freeing the client's resources
+        Freeing the client's resources. The connection goes back to the pool
+        if the response was read until the end.
         """
 
-        self.r.close()
+        if self._connection is None:
+            self.r.close()
+            return
+
+        if self.r.isclosed() and not self.r.will_close:
+            _pool.put(*self._key, self._connection)
+        else:
+            self.r.close()
+            self._connection.close()
+
+        self._connection = None
 
 
 class FileStream(DataStream):
@@ -113,6 +263,13 @@ class FileStream(DataStream):
     def read(self, length: int) -> bytes:
         return self.f.read(length)
 
+    def fileno(self) -> int:
+        """
+        File descriptor of the opened file
+        """
+
+        return self.f.fileno()
+
     def close(self) -> None:
         if self.f:
             self.f.close()